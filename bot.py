@@ -5,11 +5,14 @@ morning digests, 4-hour nudges and due-date reminders.
 """
 
 from __future__ import annotations
-import logging, os, re, textwrap, tomllib, pathlib, time
+import asyncio, functools, itertools, logging, os, re, textwrap, tomllib, pathlib, time
+from collections import OrderedDict, deque
 import datetime as dt
 from typing import Any, Dict, List
 
+from cachetools import TTLCache
 from telegram import Update, constants
+from telegram.error import RetryAfter
 from telegram.ext import (
     Application, CommandHandler, ContextTypes, MessageHandler, filters
 )
@@ -24,13 +27,18 @@ except ImportError:                      # 0.x  or  ≥ 2.0
     except ImportError:
         class ApiError(Exception): ...              # dummy fallback
 
-from utils import analyse_tasks                     # GPT splitter
+from utils import MUTABLE_FIELDS, analyse_tasks_async   # GPT splitter
 
 # ── CONFIG ──────────────────────────────────────────────────────────────────────
-_cfg = tomllib.loads(pathlib.Path(".streamlit/secrets.toml").read_text())
+@functools.lru_cache(maxsize=1)
+def _cfg() -> Dict[str, Any]:
+    """secrets.toml, read once – and only if some setting isn’t in the env."""
+    path = pathlib.Path(".streamlit/secrets.toml")
+    return tomllib.loads(path.read_text()) if path.exists() else {}
 
 def _env(key: str, fallback: str) -> str:
-    return os.getenv(key, _cfg[fallback])
+    val = os.getenv(key)
+    return val if val is not None else _cfg().get(fallback, "")
 
 BOT_TOKEN      = _env("TELEGRAM_BOT_TOKEN",  "telegram_bot_token")
 CHAT_ID        = _env("TELEGRAM_CHAT_ID",    "telegram_chat_id")
@@ -43,6 +51,66 @@ LOCAL_TZ       = dt.timezone.utc            # change to your TZ if desired
 
 table = Table(AIRTABLE_KEY, AIRTABLE_BASE, AIRTABLE_TABLE)
 
+class AsyncRateLimiter:
+    """Allow at most `rate` entries per `per` seconds (sliding window)."""
+
+    def __init__(self, rate: int, per: float) -> None:
+        self.rate, self.per = rate, per
+        self._sent: deque[float] = deque()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> None:
+        async with self._lock:
+            while len(self._sent) >= self.rate:
+                wait = self._sent[0] + self.per - time.monotonic()
+                if wait <= 0:
+                    self._sent.popleft()
+                else:
+                    await asyncio.sleep(wait)
+            self._sent.append(time.monotonic())
+
+    async def __aexit__(self, *exc) -> None:
+        return None
+
+# Airtable allows 5 req/s per base – shape traffic instead of eating 429s
+at_limiter = AsyncRateLimiter(rate=5, per=1.0)
+
+async def _airtable(fn, *args, **kw):
+    """One limiter slot per call – only for calls that make a single request."""
+    async with at_limiter:
+        return await asyncio.to_thread(fn, *args, **kw)
+
+async def _airtable_all(**kw) -> List[Dict[str, Any]]:
+    """`table.all()`, but every page fetch takes its own limiter slot."""
+    pages = table.iterate(**kw)
+    recs: List[Dict[str, Any]] = []
+    while True:
+        async with at_limiter:
+            page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return recs
+        recs.extend(page)
+
+# short-lived cache of table.all() reads; cleared on every write
+_AT_CACHE: TTLCache = TTLCache(maxsize=128, ttl=30)
+_AT_GEN = 0                                 # bumped by every _invalidate()
+
+def _invalidate() -> None:
+    global _AT_GEN
+    _AT_GEN += 1
+    _AT_CACHE.clear()
+
+async def cached_all(**kw) -> List[Dict[str, Any]]:
+    key = tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                       for k, v in kw.items()))
+    recs = _AT_CACHE.get(key)
+    if recs is None:
+        gen  = _AT_GEN
+        recs = await _airtable_all(**kw)
+        if gen == _AT_GEN:                  # a write landed mid-fetch → don’t cache
+            _AT_CACHE[key] = recs
+    return recs
+
 # ── DECORATORS / HELPERS ───────────────────────────────────────────────────────
 def typing_action(fn):
     """Show Telegram ‘typing…’ while we work."""
@@ -59,41 +127,94 @@ def _format(rec: Dict[str, Any], *, show_id=False) -> str:
     due    = f.get("DueDate", "—")
     return f"{prefix} {uid}{f['Task']}  _({due})_"
 
+# short “#abcd” ids shown to the user → full Airtable record ids
+_ID_CACHE: OrderedDict[str, str] = OrderedDict()
+_ID_CACHE_MAX = 256
+
+def _remember_ids(recs: List[Dict[str, Any]]) -> None:
+    for r in recs:
+        short = r["id"][:4]
+        _ID_CACHE[short] = r["id"]
+        _ID_CACHE.move_to_end(short)
+    while len(_ID_CACHE) > _ID_CACHE_MAX:
+        _ID_CACHE.popitem(last=False)
+
+KEEP = MUTABLE_FIELDS | {"Done", "Priority"}
+
+def _clean(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop keys Airtable doesn’t know about and empty values."""
+    return {k: fields[k] for k in fields.keys() & KEEP if fields[k] is not None}
+
+_P_FLAGS = re.compile(
+    r"(?i:--p(?:riority)?\s+(?P<prio>high|medium|low))"
+    r"|--due\s+(?P<due>\d{4}-\d{2}-\d{2})"
+)
+
 def _parse_flags(txt: str) -> tuple[str, Dict[str, Any]]:
     extra: Dict[str, Any] = {}
-    m = re.search(r"--p(?:riority)?\s+(high|medium|low)", txt, re.I)
-    if m:
-        extra["Priority"] = m.group(1).capitalize()
-        txt = txt.replace(m.group(0), "")
-    m = re.search(r"--due\s+(\d{4}-\d{2}-\d{2})", txt)
-    if m:
-        extra["DueDate"] = m.group(1)
-        txt = txt.replace(m.group(0), "")
-    return txt.strip(), extra
+
+    def _take(m: re.Match) -> str:
+        if m.group("prio"):
+            extra.setdefault("Priority", m.group("prio").capitalize())
+        else:
+            extra.setdefault("DueDate", m.group("due"))
+        return ""
+
+    return _P_FLAGS.sub(_take, txt).strip(), extra
+
+# ── OUTBOUND QUEUE ──────────────────────────────────────────────────────────────
+# Every message goes through one paced worker so bursts never hit Telegram’s
+# 30 msg/s flood limit; user replies jump ahead of scheduled broadcasts.
+SEND_RATE      = 25                         # msg/s
+PRIO_REPLY     = 0
+PRIO_BROADCAST = 1
+
+send_q: asyncio.PriorityQueue = asyncio.PriorityQueue()
+_send_seq = itertools.count()               # FIFO tie-break within a priority
+
+async def _send(chat_id, text: str, *, prio: int = PRIO_REPLY, **kw) -> None:
+    await send_q.put((prio, next(_send_seq), chat_id, text, kw))
+
+async def sender_worker(bot) -> None:
+    while True:
+        item = await send_q.get()
+        _, _, chat_id, text, kw = item
+        try:
+            await bot.send_message(chat_id, text, **kw)
+        except RetryAfter as e:
+            logging.warning("flood control – retrying in %ss", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            await send_q.put(item)
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            send_q.task_done()
+        await asyncio.sleep(1 / SEND_RATE)
+
+async def _post_init(app: Application) -> None:
+    app.bot_data["sender"] = asyncio.create_task(sender_worker(app.bot))
 
 # ── SCHEDULER CALL-BACKS ───────────────────────────────────────────────────────
 async def _after_4h(ctx: ContextTypes.DEFAULT_TYPE):
     task = ctx.job.data["task"]
-    await ctx.bot.send_message(CHAT_ID,
-                               f"⏰ 4-hour nudge: don’t forget *{task}*!",
-                               parse_mode="Markdown")
+    await _send(CHAT_ID, f"⏰ 4-hour nudge: don’t forget *{task}*!",
+                prio=PRIO_BROADCAST, parse_mode="Markdown")
 
 async def _due_reminder(ctx: ContextTypes.DEFAULT_TYPE):
     task  = ctx.job.data["task"]
     label = ctx.job.data["label"]
-    await ctx.bot.send_message(CHAT_ID,
-                               f"🗓 {label}: *{task}*",
-                               parse_mode="Markdown")
+    await _send(CHAT_ID, f"🗓 {label}: *{task}*",
+                prio=PRIO_BROADCAST, parse_mode="Markdown")
 
 async def _morning(ctx: ContextTypes.DEFAULT_TYPE):
     today = dt.date.today().isoformat()
-    recs  = table.all(formula=f"AND({{DueDate}} = '{today}', {{Done}} != 1)")
+    recs  = await cached_all(formula=f"AND({{DueDate}} = '{today}', {{Done}} != 1)")
     if not recs:
         msg = "Good morning! Nothing due today – seize the day! 🏆"
     else:
         lines = "\n".join(_format(r) for r in recs)
         msg = f"Hey, good morning. Veni Vidi Vici!  Here’s today’s tasks:\n{lines}"
-    await ctx.bot.send_message(CHAT_ID, msg, parse_mode="Markdown")
+    await _send(CHAT_ID, msg, prio=PRIO_BROADCAST, parse_mode="Markdown")
 
 # ── COMMANDS ────────────────────────────────────────────────────────────────────
 HELP = textwrap.dedent("""\
@@ -108,8 +229,8 @@ HELP = textwrap.dedent("""\
 """)
 
 async def start(u: Update, _: ContextTypes.DEFAULT_TYPE):
-    await u.message.reply_text("👋 Hi! I’m your Task bot.\n" + HELP,
-                               parse_mode="Markdown")
+    await _send(u.effective_chat.id, "👋 Hi! I’m your Task bot.\n" + HELP,
+                parse_mode="Markdown")
 
 async def ping(u: Update, _: ContextTypes.DEFAULT_TYPE):
     t0 = time.time()
@@ -121,50 +242,52 @@ async def ping(u: Update, _: ContextTypes.DEFAULT_TYPE):
 async def add(u: Update, c: ContextTypes.DEFAULT_TYPE):
     raw = " ".join(c.args)
     if not raw:
-        await u.message.reply_text("⚠️  Use `/add buy milk`", parse_mode="Markdown")
+        await _send(u.effective_chat.id, "⚠️  Use `/add buy milk`", parse_mode="Markdown")
         return
 
     task_txt, extras = _parse_flags(raw)
     try:
-        rows = analyse_tasks(
+        rows = await analyse_tasks_async(
             OPENAI_KEY, task_txt,
             clients=["General"], projects=["General"]
         )
     except Exception as e:
         logging.exception(e)
-        await u.message.reply_text("❌ GPT couldn’t parse that.")
+        await _send(u.effective_chat.id, "❌ GPT couldn’t parse that.")
         return
 
-    for row in rows:
-        row.update(extras); row.setdefault("Done", False)
-        try:
-            table.create(row)
-        except ApiError as e:
-            logging.exception(e)
-            await u.message.reply_text("❌ Airtable refused that row.")
-            return
-
-        # schedule nudges & reminders
-        jobq = c.job_queue
-        added = dt.datetime.now(tz=LOCAL_TZ)
-        jobq.run_once(_after_4h, 4*60*60,  data={"task": row["Task"]})
-
-        if row.get("DueDate"):
-            due_d = dt.datetime.fromisoformat(row["DueDate"]).date()
-            day_before = dt.datetime.combine(
-                due_d - dt.timedelta(days=1), dt.time(9, tzinfo=LOCAL_TZ))
-            jobq.run_once(_due_reminder, day_before.timestamp(),
-                          data={"task": row["Task"], "label": "⏳ due *tomorrow*"})
-            jobq.run_once(_due_reminder,
-                          dt.datetime.combine(due_d, dt.time(9, tzinfo=LOCAL_TZ)).timestamp(),
-                          data={"task": row["Task"], "label": "🚨 due *today*"})
-            jobq.run_once(_due_reminder,
-                          dt.datetime.combine(due_d - dt.timedelta(days=2),
-                                              dt.time(9, tzinfo=LOCAL_TZ)).timestamp(),
-                          data={"task": row["Task"], "label": "⚠️ due in 2 days"})
-
-    await u.message.reply_text(f"✅ *{len(rows)}* task(s) added!",
-                               parse_mode="Markdown")
+    cleaned = [_clean({**r, **extras, "Done": False}) for r in rows]
+    try:
+        for i in range(0, len(cleaned), 10):    # Airtable’s per-request max
+            await _airtable(table.batch_create, cleaned[i:i+10], typecast=True)
+    except ApiError as e:
+        logging.exception(e)
+        await _send(u.effective_chat.id, "❌ Airtable refused those rows.")
+        return
+    finally:                                # earlier chunks may have landed
+        _invalidate()
+
+    # schedule nudges & reminders
+    now = dt.datetime.now(tz=LOCAL_TZ)
+    jobs = [(_after_4h, now + dt.timedelta(hours=4), {"task": r["Task"]})
+            for r in cleaned]
+    for r in cleaned:
+        if not r.get("DueDate"):
+            continue
+        due_d = dt.date.fromisoformat(r["DueDate"])
+        for days, label in ((2, "⚠️ due in 2 days"),
+                            (1, "⏳ due *tomorrow*"),
+                            (0, "🚨 due *today*")):
+            at = dt.datetime.combine(due_d - dt.timedelta(days=days),
+                                     dt.time(9, tzinfo=LOCAL_TZ))
+            if at > now:
+                jobs.append((_due_reminder, at, {"task": r["Task"], "label": label}))
+
+    for cb, when, data in jobs:
+        c.job_queue.run_once(cb, when, data=data)
+
+    await _send(u.effective_chat.id, f"✅ *{len(rows)}* task(s) added!",
+                parse_mode="Markdown")
 
 # -------------------------------------------------------------------- /list ----
 @typing_action
@@ -174,29 +297,23 @@ async def list_tasks(u: Update, _: ContextTypes.DEFAULT_TYPE):
     week_start = today - dt.timedelta(days=today.weekday())   # Monday
     week_end   = week_start + dt.timedelta(days=6)            # Sunday
 
+    # let Airtable do the week filtering and only ship the columns we print
+    after  = (week_start - dt.timedelta(days=1)).isoformat()
+    before = (week_end + dt.timedelta(days=1)).isoformat()
+    formula = (f"AND({{Done}} != 1, IS_AFTER({{DueDate}}, '{after}'), "
+               f"IS_BEFORE({{DueDate}}, '{before}'))")
     try:
-        recs = table.all(formula="{Done} != 1")
+        week_recs = await cached_all(formula=formula, sort=["DueDate"],
+                                     fields=["Task", "Client", "Priority", "DueDate"])
     except ApiError as e:
         logging.exception(e)
-        await u.message.reply_text("❌ Airtable unreachable."); return
+        await _send(u.effective_chat.id, "❌ Airtable unreachable."); return
 
-    # keep only those inside the current week
-    def _in_week(r):
-        due = r["fields"].get("DueDate")
-        if not due:  # tasks without date aren’t listed
-            return False
-        try:
-            d = dt.date.fromisoformat(due)
-        except ValueError:
-            return False
-        return week_start <= d <= week_end
-
-    week_recs = [r for r in recs if _in_week(r)]
     if not week_recs:
-        await u.message.reply_text("📭 No tasks due this week – you’re clear!")
+        await _send(u.effective_chat.id, "📭 No tasks due this week – you’re clear!")
         return
 
-    # group → {Client: [records]}
+    # group → {Client: [records]}; Airtable already returned them by DueDate
     grouped: Dict[str, List[Any]] = {}
     for r in week_recs:
         client = r["fields"].get("Client", "General")
@@ -207,7 +324,7 @@ async def list_tasks(u: Update, _: ContextTypes.DEFAULT_TYPE):
 
     for client in sorted(grouped.keys()):
         lines: List[str] = [f"*{client}*"]
-        for r in sorted(grouped[client], key=lambda x: x["fields"]["DueDate"]):
+        for r in grouped[client]:
             f  = r["fields"]
             d  = dt.date.fromisoformat(f["DueDate"])
             rel = ("today"      if d == today else
@@ -220,41 +337,59 @@ async def list_tasks(u: Update, _: ContextTypes.DEFAULT_TYPE):
             )
         blocks.append("\n".join(lines))
 
-    await u.message.reply_text("\n\n".join(blocks), parse_mode="Markdown")
+    await _send(u.effective_chat.id, "\n\n".join(blocks), parse_mode="Markdown")
 
 # ---------------------------------------------------------------- other cmds ---
 @typing_action
 async def today(u: Update, _: ContextTypes.DEFAULT_TYPE):
-    recs = table.all(formula=f"AND({{DueDate}} = '{dt.date.today().isoformat()}', {{Done}} != 1)")
+    recs = await cached_all(formula=f"AND({{DueDate}} = '{dt.date.today().isoformat()}', {{Done}} != 1)")
     if not recs:
-        await u.message.reply_text("😎 Nothing due today."); return
-    await u.message.reply_text("\n".join(_format(r, show_id=True) for r in recs),
-                               parse_mode="Markdown")
+        await _send(u.effective_chat.id, "😎 Nothing due today."); return
+    _remember_ids(recs)
+    await _send(u.effective_chat.id,
+                "\n".join(_format(r, show_id=True) for r in recs),
+                parse_mode="Markdown")
 
 async def _by_id(uid: str):
-    for r in table.all():
-        if r["id"].startswith(uid): return r
+    """Resolve a full or short record id without scanning the whole table."""
+    if not re.fullmatch(r"\w+", uid):
+        return None
+    full = _ID_CACHE.get(uid, uid)
+    if len(full) == 17:                      # full Airtable id → direct GET
+        try:
+            return await _airtable(table.get, full)
+        except Exception as e:               # 404 / ApiError → fall back below
+            logging.info("lookup of %s failed: %s", full, e)
+            _ID_CACHE.pop(uid, None)
+    recs = await cached_all(formula=f"FIND('{uid}', RECORD_ID())=1",
+                            max_records=1, page_size=1)
+    return recs[0] if recs else None
 
 async def done(u: Update, c: ContextTypes.DEFAULT_TYPE):
-    if not c.args: await u.message.reply_text("`/done <id>`", parse_mode="Markdown"); return
+    if not c.args: await _send(u.effective_chat.id, "`/done <id>`", parse_mode="Markdown"); return
     rec = await _by_id(c.args[0].lstrip("#"))
-    if not rec: await u.message.reply_text("❌ ID not found."); return
-    table.update(rec["id"], {"Done": True}); await u.message.reply_text("✅ Done!")
+    if not rec: await _send(u.effective_chat.id, "❌ ID not found."); return
+    await _airtable(table.update, rec["id"], {"Done": True})
+    _invalidate()
+    await _send(u.effective_chat.id, "✅ Done!")
 
 async def delete(u: Update, c: ContextTypes.DEFAULT_TYPE):
-    if not c.args: await u.message.reply_text("`/delete <id>`", parse_mode="Markdown"); return
+    if not c.args: await _send(u.effective_chat.id, "`/delete <id>`", parse_mode="Markdown"); return
     rec = await _by_id(c.args[0].lstrip("#"))
-    if not rec: await u.message.reply_text("❌ ID not found."); return
-    table.delete(rec["id"]); await u.message.reply_text("🗑️ Deleted!")
+    if not rec: await _send(u.effective_chat.id, "❌ ID not found."); return
+    await _airtable(table.delete, rec["id"])
+    _invalidate(); _ID_CACHE.pop(rec["id"][:4], None)
+    await _send(u.effective_chat.id, "🗑️ Deleted!")
 
 async def unknown(u: Update, _: ContextTypes.DEFAULT_TYPE):
-    await u.message.reply_text("🤖 Unknown command. `/help`")
+    await _send(u.effective_chat.id, "🤖 Unknown command. `/help`")
 
 # ── MAIN ────────────────────────────────────────────────────────────────────────
 def main() -> None:
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s | %(levelname)s | %(message)s")
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (Application.builder().token(BOT_TOKEN)
+           .post_init(_post_init).build())
 
     app.add_handler(CommandHandler(["start","help"], start))
     app.add_handler(CommandHandler("ping",    ping))
@@ -269,7 +404,15 @@ def main() -> None:
     app.job_queue.run_daily(_morning, time=dt.time(8, 0, tzinfo=LOCAL_TZ))
 
     print("🤖 Bot is up. Ctrl-C to stop.")
-    app.run_polling(drop_pending_updates=True)
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if webhook_url:                         # deployed: Telegram pushes updates
+        app.run_webhook(listen="0.0.0.0",
+                        port=int(os.getenv("PORT", "8080")),
+                        url_path=BOT_TOKEN,
+                        webhook_url=f"{webhook_url.rstrip('/')}/{BOT_TOKEN}",
+                        drop_pending_updates=True)
+    else:                                   # local dev
+        app.run_polling(drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,15 @@
-import json
-import pandas as pd
-from typing import List, Dict, Any
-from datetime import datetime
-from dateutil import parser as date_parser
+import asyncio
+import csv
+import os
+from bisect import bisect_left
+from typing import List, Dict, Any, Optional
+from datetime import date, datetime
+
+try:                                     # ~2-3x faster on long task dumps
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
 
-from openai import OpenAI, OpenAIError
 from pyairtable import Table
 from telegram import Bot
 
@@ -18,20 +23,94 @@ CATEGORIES = [
     "🔥 Deep Work",
 ]
 
+# upper bound (inclusive, minutes) of each category; anything above → last one
+_THRESHOLDS = (1.5, 5, 10, 25, 60)
+
 def _bucket(mins: int) -> str:
-    if mins <= 1.5:
-        return "🕑 Lifeline"
-    if mins <= 5:
-        return "⚡ Quick Task"
-    if mins <= 10:
-        return "🔹 Small Task"
-    if mins <= 25:
-        return "🔸 Focused Sprint"
-    if mins <= 60:
-        return "🔶 1 Hour Challenge"
-    return "🔥 Deep Work"
+    return CATEGORIES[bisect_left(_THRESHOLDS, mins)]
 
 # ──────────── 2. GPT → structured rows ────────────
+# openai is imported lazily: it is heavy and only needed once a request is made
+_ASYNC_CLIENTS: Dict[str, Any] = {}
+
+def _get_async_client(api_key: str) -> Any:
+    from openai import AsyncOpenAI
+    if api_key not in _ASYNC_CLIENTS:
+        _ASYNC_CLIENTS[api_key] = AsyncOpenAI(api_key=api_key)
+    return _ASYNC_CLIENTS[api_key]
+
+# Structured-outputs schema: OpenAI guarantees replies of exactly this shape.
+TASK_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "tasks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Task":           {"type": "string"},
+                    "Client":         {"type": "string"},
+                    "Project":        {"type": "string"},
+                    "Est. Minutes":   {"type": "integer"},
+                    "Early Bonus":    {"type": "integer"},
+                    "Penalty":        {"type": "integer"},
+                    "Actual Minutes": {"type": ["integer", "null"]},
+                    "DueDate":        {"type": ["string", "null"]},
+                },
+                "required": [
+                    "Task", "Client", "Project", "Est. Minutes",
+                    "Early Bonus", "Penalty", "Actual Minutes", "DueDate",
+                ],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["tasks"],
+    "additionalProperties": False,
+}
+
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "tasks", "strict": True, "schema": TASK_SCHEMA},
+}
+
+def _prompt(text: str, clients: List[str], projects: List[str]) -> str:
+    return (
+        "You are a productivity-game assistant.\n"
+        f"Allowed clients: {', '.join(clients)}\n"
+        f"Allowed projects: {', '.join(projects)}\n"
+        "Return one entry in `tasks` per task sentence.\n"
+        "DueDate MUST be ISO-8601 `YYYY-MM-DD`, or null if none is given.\n\n"
+        "TEXT:\n"
+        f"{text}\n"
+    )
+
+def _parse_due(raw: str) -> Optional[str]:
+    """ISO fast path; dateutil only for the odd free-form date GPT slips in."""
+    try:
+        return date.fromisoformat(raw[:10]).isoformat()
+    except (TypeError, ValueError):
+        pass
+    try:
+        from dateutil import parser as date_parser
+        return date_parser.parse(raw, default=datetime.now()).date().isoformat()
+    except Exception:
+        return None
+
+def _postprocess(content: str) -> List[Dict[str, Any]]:
+    """Turn GPT's JSON reply into normalised Airtable rows."""
+    data = _loads(content)["tasks"]
+
+    for row in data:
+        # 1) Timer Category enforced by bucket
+        row["Timer Category"] = _bucket(row["Est. Minutes"])
+
+        # 2) Normalise DueDate if present
+        raw_due = row.pop("DueDate", None)
+        row["DueDate"] = _parse_due(raw_due) if raw_due else None
+
+    return data
+
 def analyse_tasks(
     api_key: str,
     text: str,
@@ -43,69 +122,57 @@ def analyse_tasks(
     Parse free-form text into Airtable-ready rows.
     Enforce Timer Category by Est. Minutes, and parse any DueDate text into ISO.
     """
-    prompt = (
-        "You are a productivity-game assistant.\n"
-        f"Allowed clients: {', '.join(clients)}\n"
-        f"Allowed projects: {', '.join(projects)}\n"
-        "For each task sentence, return JSON objects with EXACTLY these keys:\n"
-        "  Task, Client, Project, Est. Minutes, Timer Category, Early Bonus, Penalty, Actual Minutes, DueDate (optional)\n"
-        "Do NOT include any extra keys or prose.\n\n"
-        "TEXT:\n"
-        f"{text}\n"
-    )
-
+    from openai import OpenAI, OpenAIError
     try:
         client = OpenAI(api_key=api_key)
         res = client.chat.completions.create(
             model=model,
-            messages=[{"role":"user","content":prompt}],
-            response_format={"type":"json_object"},
+            messages=[{"role":"user","content":_prompt(text, clients, projects)}],
+            response_format=_RESPONSE_FORMAT,
             temperature=0.1,
         )
     except OpenAIError as e:
         raise RuntimeError(f"OpenAI error → {e}") from e
 
-    data = json.loads(res.choices[0].message.content)
-
-    # unwrap if GPT nested under "tasks"
-    if isinstance(data, dict) and "tasks" in data:
-        data = data["tasks"]
-    if isinstance(data, dict):
-        data = [data]
+    return _postprocess(res.choices[0].message.content)
 
-    for row in data:
-        # 1) Est. Minutes → integer
-        mins = int(row.get("Est. Minutes", 0) or 0)
-        row["Est. Minutes"] = mins
-
-        # 2) Timer Category enforced by bucket
-        row["Timer Category"] = _bucket(mins)
-
-        # 3) Defaults
-        row.setdefault("Client", "General")
-        row.setdefault("Project", "General")
-        row.setdefault("Early Bonus", 0)
-        row.setdefault("Penalty", 0)
-        row.setdefault("Actual Minutes", None)
-
-        # 4) Parse DueDate if present
-        raw_due = row.pop("DueDate", None) or row.pop("Due Date", None)
-        if raw_due:
-            try:
-                dt = date_parser.parse(raw_due, default=datetime.now())
-                row["DueDate"] = dt.date().isoformat()
-            except Exception:
-                row["DueDate"] = None
-        else:
-            row["DueDate"] = None
+async def analyse_tasks_async(
+    api_key: str,
+    text: str,
+    clients: List[str],
+    projects: List[str],
+    model: str = "gpt-4o-mini",
+) -> List[Dict[str, Any]]:
+    """
+    Same as `analyse_tasks`, but awaits OpenAI so the bot's event loop stays free.
+    """
+    from openai import OpenAIError
+    try:
+        res = await _get_async_client(api_key).chat.completions.create(
+            model=model,
+            messages=[{"role":"user","content":_prompt(text, clients, projects)}],
+            response_format=_RESPONSE_FORMAT,
+            temperature=0.1,
+        )
+    except OpenAIError as e:
+        raise RuntimeError(f"OpenAI error → {e}") from e
 
-    return data
+    return _postprocess(res.choices[0].message.content)
 
 # ──────────── 3. Airtable / CSV / Telegram ────────────
-MUTABLE_FIELDS = {
+MUTABLE_FIELDS = frozenset({
     "Task", "Client", "Project", "Timer Category", "Est. Minutes",
     "Early Bonus", "Penalty", "Actual Minutes", "DueDate",
-}
+})
+
+# Tables are reused across Streamlit reruns so their HTTP pools stay warm
+_TABLES: Dict[tuple, Table] = {}
+
+def _get_table(api_key: str, base_id: str, table_name: str) -> Table:
+    key = (api_key, base_id, table_name)
+    if key not in _TABLES:
+        _TABLES[key] = Table(api_key, base_id, table_name)
+    return _TABLES[key]
 
 def push_airtable(
     api_key: str,
@@ -113,13 +180,47 @@ def push_airtable(
     table_name: str,
     rows: List[Dict[str, Any]]
 ) -> None:
-    table = Table(api_key, base_id, table_name)
-    for r in rows:
-        clean = {k: v for k, v in r.items() if k in MUTABLE_FIELDS and v is not None}
-        table.create(clean)
+    table = _get_table(api_key, base_id, table_name)
+    cleaned = [
+        {k: r[k] for k in r.keys() & MUTABLE_FIELDS if r[k] is not None}
+        for r in rows
+    ]
+    # one POST per 10 records instead of one per row
+    table.batch_create(cleaned, typecast=True)
 
 def save_csv(rows: List[Dict[str, Any]], fname: str = "tasks.csv") -> None:
-    pd.DataFrame(rows).to_csv(fname, index=False)
+    """
+    Append rows to the CSV log, writing a header only for a fresh file.
+    The header is fixed once written: rows with columns it lacks raise ValueError.
+    """
+    if not rows:
+        return
+    fresh = not os.path.exists(fname) or os.path.getsize(fname) == 0
+    if fresh:
+        fields = list(dict.fromkeys(k for r in rows for k in r))
+    else:
+        # keep the existing column order so appended rows line up
+        with open(fname, newline="", encoding="utf-8") as f:
+            fields = next(csv.reader(f), [])
+        unknown = {k for r in rows for k in r} - set(fields)
+        if unknown:
+            raise ValueError(f"{fname} has no column(s) {sorted(unknown)}")
+        with open(fname, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    with open(fname, "a", newline="", encoding="utf-8") as f:
+        # LF endings, matching the existing log (and pandas' to_csv before it)
+        w = csv.DictWriter(f, fieldnames=fields, lineterminator="\n")
+        if fresh:
+            w.writeheader()
+        elif needs_newline:                 # don't glue onto the last row
+            f.write("\n")
+        w.writerows(rows)
 
 def notify(bot_token: str, chat_id: str, msg: str) -> None:
-    Bot(bot_token).send_message(chat_id=chat_id, text=msg)
+    # Bot is async in PTB 20; a fresh one per call, since its HTTP client is
+    # bound to the event loop that asyncio.run creates and then closes
+    async def _send() -> None:
+        async with Bot(bot_token) as bot:
+            await bot.send_message(chat_id=chat_id, text=msg)
+    asyncio.run(_send())